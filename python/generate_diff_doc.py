@@ -1,166 +1,344 @@
 #!/usr/bin/env python3
 import subprocess
 import argparse
+import re
+from collections import defaultdict
 import datetime
+import os
+import selectors
 import sys
+import threading
 
 def run_command(command):
-    """Runs a shell command and returns its output, handling errors."""
+    """Runs a shell command and returns its raw (stdout, returncode, stderr)."""
+    if not hasattr(os, 'posix_spawnp'):
+        # posix_spawn is not available on Windows
+        try:
+            result = subprocess.run(
+                command,
+                check=False,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        except FileNotFoundError:
+            print(f"Error: Command '{command[0]}' not found. Is git installed and in your PATH?")
+            sys.exit(1)
+        return result.stdout, result.returncode, result.stderr
+
+    stdout_r, stdout_w = os.pipe()
+    stderr_r, stderr_w = os.pipe()
     try:
-        result = subprocess.run(
+        pid = os.posix_spawnp(
+            command[0],
             command,
-            check=True,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            encoding='utf-8'
+            os.environ,
+            file_actions=[
+                (os.POSIX_SPAWN_DUP2, stdout_w, 1),
+                (os.POSIX_SPAWN_DUP2, stderr_w, 2),
+            ]
         )
-        return result.stdout
     except FileNotFoundError:
         print(f"Error: Command '{command[0]}' not found. Is git installed and in your PATH?")
         sys.exit(1)
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {' '.join(command)}")
-        print(f"Stderr: {e.stderr}")
-        sys.exit(1)
-
-def get_changed_files(base_ref, feature_ref):
-    """Gets lists of added, modified, deleted, and renamed files."""
-    command = ['git', 'diff', '--name-status', f'{base_ref}..{feature_ref}']
-    output = run_command(command)
+    finally:
+        os.close(stdout_w)
+        os.close(stderr_w)
+
+    output = {stdout_r: bytearray(), stderr_r: bytearray()}
+    with selectors.DefaultSelector() as selector:
+        for fd in output:
+            selector.register(fd, selectors.EVENT_READ)
+        while selector.get_map():
+            for key, _ in selector.select():
+                data = os.read(key.fd, 1 << 16)
+                if data:
+                    output[key.fd] += data
+                else:
+                    selector.unregister(key.fd)
+                    os.close(key.fd)
+
+    _, status = os.waitpid(pid, 0)
+    return bytes(output[stdout_r]), os.waitstatus_to_exitcode(status), bytes(output[stderr_r])
+
+def exit_on_command_error(command, stderr):
+    """Reports a failed command along with its stderr and exits."""
+    print(f"Error executing command: {' '.join(command)}")
+    print(f"Stderr: {stderr.decode('utf-8', 'replace')}")
+    sys.exit(1)
+
+def resolve_refs(base_ref, feature_ref):
+    """Resolves both refs to commit SHAs with a single `git rev-parse` call."""
+    command = ['git', 'rev-parse', f'{base_ref}^{{commit}}', f'{feature_ref}^{{commit}}']
+    output, returncode, stderr = run_command(command)
+    if returncode != 0:
+        exit_on_command_error(command, stderr)
+    base_sha, feature_sha = output.decode('ascii').split()
+    return base_sha, feature_sha
+
+def collect_change_metadata(base_ref, feature_ref):
+    """Collects added, modified, deleted, and renamed files, content-changed paths and line stats."""
+    command = ['git', 'diff-tree', '-r', '-z', '-M', '--raw', '--numstat', base_ref, feature_ref]
+    output, returncode, stderr = run_command(command)
+    if returncode != 0:
+        exit_on_command_error(command, stderr)
 
     added_files = []
     modified_files = []
     deleted_files = []
     renamed_files = []
+    content_changed = []
+    stats = {}
 
-    for line in output.strip().split('\n'):
-        if not line:
+    tokens = iter(output.split(b'\x00'))
+    for token in tokens:
+        if not token:
             continue
-        parts = line.split('\t')
-        status = parts[0]
-        files = parts[1:]
-
-        if status.startswith('A'):
-            added_files.append(files[0])
-        elif status.startswith('M'):
-            modified_files.append(files[0])
-        elif status.startswith('D'):
-            deleted_files.append(files[0])
-        elif status.startswith('R'):
-            # Renamed files are represented as R<score>\t<old_path>\t<new_path>
-            renamed_files.append((files[0], files[1]))
-
-    return added_files, modified_files, deleted_files, renamed_files
-
-def get_file_diff(base_ref, feature_ref, file_path):
-    """Gets the diff for a single file."""
-    # Use --unified=10 to get more context around changes
-    command = ['git', 'diff', '--unified=10', f'{base_ref}..{feature_ref}', '--', file_path]
-    return run_command(command)
-
-def get_diff_stats(base_ref, feature_ref):
-    """Gets line additions and deletions for each file."""
-    command = ['git', 'diff', '--numstat', f'{base_ref}..{feature_ref}']
-    output = run_command(command)
 
-    stats = {}
-    for line in output.strip().split('\n'):
-        if not line:
-            continue
-        parts = line.split('\t')
-        if len(parts) == 3:
-            added, deleted, file_path = parts
+        if token.startswith(b':'):
+            # Raw entries look like ':<old_mode> <new_mode> <old_sha> <new_sha> <status>\0<path>\0[<new_path>\0]'
+            status = token.rsplit(b' ', 1)[-1]
+            path = os.fsdecode(next(tokens))
+
+            if status.startswith(b'A'):
+                added_files.append(path)
+                content_changed.append(path)
+            elif status.startswith(b'M'):
+                modified_files.append(path)
+                content_changed.append(path)
+            elif status.startswith(b'D'):
+                deleted_files.append(path)
+            elif status.startswith(b'R'):
+                # Renamed files are represented as R<score>\0<old_path>\0<new_path>
+                new_path = os.fsdecode(next(tokens))
+                renamed_files.append((path, new_path))
+                content_changed.append(new_path)
+            elif status.startswith(b'C'):
+                next(tokens)
+        else:
+            # Renamed numstat entries are represented as <added>\t<deleted>\t\0<old_path>\0<new_path>
+            added, deleted, file_path = token.split(b'\t', 2)
+            if not file_path:
+                next(tokens)
+                file_path = next(tokens)
             # Handle binary files, which are represented with '-' for additions/deletions
-            added_val = 0 if added == '-' else int(added)
-            deleted_val = 0 if deleted == '-' else int(deleted)
-            stats[file_path] = (added_val, deleted_val)
-    return stats
-def generate_tree_structure(files):
-    """Builds a tree structure from a list of files and their stats."""
-    tree = {'children': {}, 'stats': {}}
-    for file_path, file_info in files.items():
-        parts = file_path.split('/')
-        current_level = tree['children']
-        for part in parts[:-1]:
-            if part not in current_level:
-                current_level[part] = {'children': {}, 'stats': {}}
-            current_level = current_level[part]['children']
-
-        file_name = parts[-1]
-        # Store file info directly, including its own stats for sorting
-        additions = file_info.get('additions', 0)
-        deletions = file_info.get('deletions', 0)
-        file_info['total_changes'] = additions + deletions
-        current_level[file_name] = file_info
-    return tree
-
-def calculate_and_sort_tree_stats(node):
-    """Recursively calculates stats for directories and sorts their children."""
-    if not isinstance(node, dict) or 'children' not in node:
-        return 0, 0, 0
-
-    total_additions = 0
-    total_deletions = 0
-
-    # Recurse first
-    for name, content in node['children'].items():
-        calculate_and_sort_tree_stats(content)
-
-    # Calculate stats for the current node
-    for name, content in node['children'].items():
-        if isinstance(content, dict) and 'status' in content: # It's a file
-            total_additions += content.get('additions', 0)
-            total_deletions += content.get('deletions', 0)
-        elif isinstance(content, dict) and 'stats' in content: # It's a directory
-            total_additions += content['stats'].get('additions', 0)
-            total_deletions += content['stats'].get('deletions', 0)
-
-    node['stats'] = {
-        'additions': total_additions,
-        'deletions': total_deletions,
-        'total_changes': total_additions + total_deletions
-    }
-
-    # Sort children by total_changes
-    sorted_children = sorted(
-        node['children'].items(),
-        key=lambda item: (item[1].get('total_changes', 0) if 'status' in item[1] else item[1]['stats'].get('total_changes', 0))
+            added_val = 0 if added == b'-' else int(added)
+            deleted_val = 0 if deleted == b'-' else int(deleted)
+            stats[os.fsdecode(file_path)] = (added_val, deleted_val)
+
+    return added_files, modified_files, deleted_files, renamed_files, content_changed, stats
+
+MAX_FILE_LINES = 5000
+MAX_DIFF_BYTES = 200_000
+
+_DIFF_HEADER = re.compile(rb'^diff --git (.+)$', re.MULTILINE)
+
+_C_QUOTE_ESCAPE = re.compile(rb'\\([0-7]{3}|.)', re.DOTALL)
+_C_QUOTE_CHARS = {
+    b'a': b'\a', b'b': b'\b', b't': b'\t', b'n': b'\n', b'v': b'\v',
+    b'f': b'\f', b'r': b'\r', b'"': b'"', b'\\': b'\\',
+}
+
+def unquote_c_path(path):
+    """Undoes git's C-style escaping of a quoted path."""
+    return _C_QUOTE_ESCAPE.sub(
+        lambda m: bytes([int(m.group(1), 8)]) if len(m.group(1)) == 3 else _C_QUOTE_CHARS.get(m.group(1), m.group(1)),
+        path
     )
-    node['children'] = dict(sorted_children)
 
-def format_tree(tree, indent=""):
-    """Formats the tree structure into a markdown string."""
-    lines = []
-    items = list(tree.items())
-    for i, (name, content) in enumerate(items):
-        connector = "└── " if i == len(items) - 1 else "├── "
+def diff_header_path(paths):
+    """Returns the file path from the 'a/<path> b/<path>' part of a diff header."""
+    # Both sides name the same path, so take the second half
+    path = paths[(len(paths) + 1) // 2:]
+    if path.startswith(b'"'):
+        path = unquote_c_path(path[1:-1])
+    return path[2:]
 
-        is_file = isinstance(content, dict) and 'status' in content
+def encode_text(text):
+    """Encodes markdown text for the binary output file."""
+    return text.encode('utf-8', 'surrogateescape')
 
-        if is_file:
-            status = content['status']
-            additions = content.get('additions', 0)
-            deletions = content.get('deletions', 0)
+def start_content_diff(base_ref, feature_ref):
+    """Starts the content diff for every changed file and returns the running process."""
+    # Use --unified=10 to get more context around changes
+    command = [
+        'git', '-c', 'core.quotePath=false', 'diff-tree', '-p', '-r', '--unified=10',
+        '--diff-filter=d', base_ref, feature_ref
+    ]
+    try:
+        return subprocess.Popen(
+            command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            bufsize=1 << 16
+        )
+    except FileNotFoundError:
+        print(f"Error: Command '{command[0]}' not found. Is git installed and in your PATH?")
+        sys.exit(1)
 
-            if status == 'Renamed':
-                old_path = content['old_path']
-                lines.append(f"{indent}{connector}`{name}` -> `{old_path}` (Renamed)")
+def write_all_diffs(proc, files_to_diff, stats, out):
+    """Streams the diff output of `proc` into `out`, one section per file in `files_to_diff`."""
+    wanted = {os.fsencode(file_path) for file_path in files_to_diff}
+    seen = set()
+    keep = False
+    remaining = MAX_DIFF_BYTES
+    at_line_start = True
+    pending = []
+
+    def write_body(data):
+        nonlocal remaining, at_line_start
+        if not data or remaining < 0:
+            return
+        if remaining == 0:
+            remaining = -1
+            return
+        if len(data) > remaining:
+            # Don't split a UTF-8 character
+            cut = remaining
+            while cut and (data[cut] & 0xC0) == 0x80:
+                cut -= 1
+            data = data[:cut]
+            remaining = -1
+        else:
+            remaining -= len(data)
+        if data:
+            out.write(data)
+            at_line_start = data.endswith(b'\n')
+
+    def close_section():
+        if not at_line_start:
+            out.write(b'\n')
+        out.write(b"```\n\n")
+        if remaining < 0:
+            out.write(encode_text(f"_Diff too large; showing first {MAX_DIFF_BYTES} bytes_\n\n"))
+
+    stderr_chunks = []
+    stderr_reader = threading.Thread(target=lambda: stderr_chunks.append(proc.stderr.read()))
+    stderr_reader.start()
+
+    with proc:
+        while True:
+            chunk = proc.stdout.read(1 << 16)
+            # Only scan up to the last complete line so headers are never split across blocks
+            end = chunk.rfind(b'\n') + 1 if chunk else 0
+            if chunk and not end:
+                pending.append(chunk)
+                continue
+            pending.append(chunk[:end])
+            block = b''.join(pending)
+            pending = [chunk[end:]]
+
+            pos = 0
+            for match in _DIFF_HEADER.finditer(block):
+                if keep:
+                    write_body(block[pos:match.start()])
+                    close_section()
+                pos = match.start()
+                file_path = diff_header_path(match.group(1))
+                keep = file_path in wanted
+                if keep:
+                    seen.add(file_path)
+                    remaining = MAX_DIFF_BYTES
+                    at_line_start = True
+                    print(f"  ({len(seen)}/{len(files_to_diff)}) Processing: {file_path.decode('utf-8', 'replace')}")
+                    out.write(b"### `" + file_path + b"`\n\n")
+                    added, deleted = stats.get(os.fsdecode(file_path), (0, 0))
+                    if added + deleted > MAX_FILE_LINES:
+                        out.write(encode_text(f"_Large diff ({added}+/{deleted}-)_\n\n"))
+                    out.write(b"```diff\n")
+            if keep:
+                write_body(block[pos:])
+
+            if not chunk:
+                break
+        if keep:
+            close_section()
+        stderr_reader.join()
+
+    if proc.returncode != 0:
+        exit_on_command_error(proc.args, b''.join(stderr_chunks))
+
+    missing = [file_path for file_path in files_to_diff if os.fsencode(file_path) not in seen]
+    if missing:
+        print(f"Warning: no diff was found for {len(missing)} of {len(files_to_diff)} files:")
+        for file_path in missing:
+            print(f"  {file_path}")
+            out.write(encode_text(f"### `{file_path}`\n\nCould not generate diff. Error: not found in git output\n\n"))
+
+def format_tree(files, out):
+    """Writes the files to `out` as a markdown tree, ordering each level by total changes."""
+    dir_stats = defaultdict(lambda: [0, 0])
+    first_seen = {}
+    entries = []
+    for file_path, file_info in files.items():
+        parts = tuple(file_path.split('/'))
+        additions = file_info.get('additions', 0)
+        deletions = file_info.get('deletions', 0)
+        for depth in range(1, len(parts)):
+            prefix = parts[:depth]
+            first_seen.setdefault(prefix, len(first_seen))
+            stats = dir_stats[prefix]
+            stats[0] += additions
+            stats[1] += deletions
+        first_seen.setdefault(parts, len(first_seen))
+        entries.append((parts, file_info))
+
+    def sort_key(entry):
+        parts, file_info = entry
+        key = [(sum(dir_stats[parts[:depth]]), first_seen[parts[:depth]]) for depth in range(1, len(parts))]
+        key.append((file_info.get('additions', 0) + file_info.get('deletions', 0), first_seen[parts]))
+        return key
+
+    entries.sort(key=sort_key)
+
+    last_child = {}
+    for parts, _ in reversed(entries):
+        for depth in range(1, len(parts) + 1):
+            last_child.setdefault(parts[:depth - 1], parts[:depth])
+
+    indents = [""]
+    previous_dirs = ()
+    for parts, file_info in entries:
+        dirs = parts[:-1]
+        common = 0
+        while common < min(len(dirs), len(previous_dirs)) and dirs[common] == previous_dirs[common]:
+            common += 1
+        del indents[common + 1:]
+
+        for depth in range(common + 1, len(parts) + 1):
+            node = parts[:depth]
+            is_last = last_child[parts[:depth - 1]] == node
+            indent = indents[depth - 1]
+            connector = "└── " if is_last else "├── "
+            name = parts[depth - 1]
+
+            if depth < len(parts): # It's a directory
+                additions, deletions = dir_stats[node]
+                out.write(encode_text(f"{indent}{connector}{name}/ (Modified, +{additions}, -{deletions})\n"))
+                indents.append(indent + ("    " if is_last else "│   "))
             else:
-                lines.append(f"{indent}{connector}`{name}` ({status}, +{additions}, -{deletions})")
-        elif isinstance(content, dict): # It's a directory
-            stats = content['stats']
-            additions = stats.get('additions', 0)
-            deletions = stats.get('deletions', 0)
-            lines.append(f"{indent}{connector}{name}/ (Modified, +{additions}, -{deletions})")
-            lines.extend(format_tree(content['children'], indent + ("    " if i == len(items) - 1 else "│   ")))
-    return lines
-
-def generate_markdown(base_ref, feature_ref, output_file):
+                status = file_info['status']
+                additions = file_info.get('additions', 0)
+                deletions = file_info.get('deletions', 0)
+
+                if status == 'Renamed':
+                    old_path = file_info['old_path']
+                    out.write(encode_text(f"{indent}{connector}`{name}` -> `{old_path}` (Renamed)\n"))
+                else:
+                    out.write(encode_text(f"{indent}{connector}`{name}` ({status}, +{additions}, -{deletions})\n"))
+        previous_dirs = dirs
+
+def generate_markdown(base_ref, feature_ref, output_file, summary_only=False):
     """Generates the full markdown documentation."""
     print("Gathering file changes...")
-    added, modified, deleted, renamed = get_changed_files(base_ref, feature_ref)
-    stats = get_diff_stats(base_ref, feature_ref)
+    base_sha, feature_sha = resolve_refs(base_ref, feature_ref)
+    diff_proc = None if summary_only else start_content_diff(base_sha, feature_sha)
+    try:
+        added, modified, deleted, renamed, files_to_diff, stats = collect_change_metadata(base_sha, feature_sha)
+    except BaseException:
+        if diff_proc:
+            diff_proc.kill()
+            diff_proc.communicate()
+        raise
 
     print(f"Found {len(added)} added, {len(modified)} modified, {len(deleted)} deleted, and {len(renamed)} renamed files.")
 
@@ -177,51 +355,33 @@ def generate_markdown(base_ref, feature_ref, output_file):
     for f in deleted:
         all_files[f] = {'status': 'Deleted', 'additions': 0, 'deletions': 0} # Deletions are not tracked for deleted files in numstat
 
-    # Start building the markdown content
-    md_content = []
-    md_content.append(f"# Code Changes from `{base_ref}` to `{feature_ref}`\n")
-    md_content.append(f"> _Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S AEST')}_\n")
-    md_content.append("This document outlines the code modifications, additions, and deletions\n")
-
-    # --- Summary Section ---
-    md_content.append("## Summary of Changes\n")
-
-    if all_files:
-        tree = generate_tree_structure(all_files)
-        calculate_and_sort_tree_stats(tree)
-        md_content.append("```")
-        md_content.extend(format_tree(tree['children']))
-        md_content.append("```\n")
-    else:
-        md_content.append("No changes detected.\n")
-
-    # --- Detailed Changes Section ---
-    md_content.append("---\n")
-    md_content.append("## Detailed File Changes\n")
-
-    files_to_diff = sorted(added + modified + [new for old, new in renamed])
-
-    if not files_to_diff:
-        md_content.append("No files with content changes to display.")
-    else:
-        print("Generating detailed diffs for each file...")
-        for i, file_path in enumerate(files_to_diff):
-            print(f"  ({i+1}/{len(files_to_diff)}) Processing: {file_path}")
-            try:
-                diff_output = get_file_diff(base_ref, feature_ref, file_path)
-                md_content.append(f"### `{file_path}`\n")
-                md_content.append("```diff")
-                # Clean up the diff output slightly for better rendering
-                md_content.append(diff_output.strip())
-                md_content.append("```\n")
-            except Exception as e:
-                md_content.append(f"### `{file_path}`\n")
-                md_content.append(f"Could not generate diff. Error: {e}\n")
-
-    # --- Write to file ---
-    final_output = "\n".join(md_content)
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(final_output)
+    with open(output_file, 'wb', buffering=1 << 20) as out:
+        out.write(encode_text(f"# Code Changes from `{base_ref}` to `{feature_ref}`\n\n"))
+        out.write(encode_text(f"> _Generated on: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S AEST')}_\n\n"))
+        out.write(b"This document outlines the code modifications, additions, and deletions\n\n")
+
+        # --- Summary Section ---
+        out.write(b"## Summary of Changes\n\n")
+
+        if all_files:
+            out.write(b"```\n")
+            format_tree(all_files, out)
+            out.write(b"```\n\n")
+        else:
+            out.write(b"No changes detected.\n\n")
+
+        # --- Detailed Changes Section ---
+        if not summary_only:
+            out.write(b"---\n\n")
+            out.write(b"## Detailed File Changes\n\n")
+
+            if not files_to_diff:
+                out.write(b"No files with content changes to display.\n")
+                diff_proc.kill()
+                diff_proc.communicate()
+            else:
+                print("Generating detailed diffs for each file...")
+                write_all_diffs(diff_proc, files_to_diff, stats, out)
 
     print(f"\n✅ Successfully generated documentation at: {output_file}")
 
@@ -247,7 +407,12 @@ if __name__ == "__main__":
         default='CHANGES.md',
         help="The name of the output markdown file (default: CHANGES.md)."
     )
+    parser.add_argument(
+        '--summary-only',
+        action='store_true',
+        help="Only write the summary tree and skip the detailed per-file diffs."
+    )
 
     args = parser.parse_args()
 
-    generate_markdown(args.base_ref, args.feature_ref, args.output)
+    generate_markdown(args.base_ref, args.feature_ref, args.output, args.summary_only)
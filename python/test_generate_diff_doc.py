@@ -0,0 +1,79 @@
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import generate_diff_doc
+
+
+class DiffHeaderPathTest(unittest.TestCase):
+    def test_plain_path(self):
+        self.assertEqual(generate_diff_doc.diff_header_path(b'a/src/x.py b/src/x.py'), b'src/x.py')
+
+    def test_path_with_spaces_and_b_slash(self):
+        self.assertEqual(generate_diff_doc.diff_header_path(b'a/p b/q b/p b/q'), b'p b/q')
+
+    def test_quoted_path(self):
+        self.assertEqual(generate_diff_doc.diff_header_path(b'"a/we\\"ird.txt" "b/we\\"ird.txt"'), b'we"ird.txt')
+        self.assertEqual(generate_diff_doc.diff_header_path(b'"a/ta\\tb.txt" "b/ta\\tb.txt"'), b'ta\tb.txt')
+        self.assertEqual(generate_diff_doc.diff_header_path(b'"a/\\303\\251.txt" "b/\\303\\251.txt"'), 'é.txt'.encode())
+
+
+@unittest.skipIf(shutil.which('git') is None, "git is not installed")
+class GenerateMarkdownTest(unittest.TestCase):
+    FILE_NAMES = ['plain space.txt', 'p b/q', 'we"ird.txt', 'ta\tb.txt', 'back\\slash.txt']
+
+    def git(self, *args):
+        subprocess.run(['git', *args], cwd=self.repo, check=True, stdout=subprocess.DEVNULL)
+
+    def setUp(self):
+        self.repo = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.repo)
+        self.git('init', '-q')
+        self.git('config', 'user.email', 'test@example.com')
+        self.git('config', 'user.name', 'test')
+        with open(os.path.join(self.repo, 'README'), 'w') as f:
+            f.write('base\n')
+        self.git('add', '-A')
+        self.git('commit', '-qm', 'base')
+        self.git('tag', 'base')
+        for name in self.FILE_NAMES:
+            path = os.path.join(self.repo, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as f:
+                f.write('content\n')
+        self.git('add', '-A')
+        self.git('commit', '-qm', 'feature')
+        self.git('tag', 'feature')
+
+    def generate(self):
+        output_file = os.path.join(self.repo, 'CHANGES.md')
+        cwd = os.getcwd()
+        os.chdir(self.repo)
+        try:
+            generate_diff_doc.generate_markdown('base', 'feature', output_file)
+        finally:
+            os.chdir(cwd)
+        with open(output_file, 'rb') as f:
+            return f.read()
+
+    def test_unusual_paths_get_sections(self):
+        output = self.generate()
+        for name in self.FILE_NAMES:
+            self.assertIn(b"### `" + name.encode() + b"`\n\n```diff\n", output)
+        self.assertNotIn(b"Could not generate diff", output)
+
+    def test_user_diff_config_is_ignored(self):
+        self.git('config', 'diff.noprefix', 'true')
+        self.git('config', 'color.ui', 'always')
+        output = self.generate()
+        for name in self.FILE_NAMES:
+            self.assertIn(b"### `" + name.encode() + b"`\n\n```diff\n", output)
+
+
+if __name__ == '__main__':
+    unittest.main()